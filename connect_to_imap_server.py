@@ -1,40 +1,138 @@
+import atexit
 import imaplib
 import logging
-from typing import Optional
+import re
+import select
+import ssl
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+logger = logging.getLogger(__name__)
+
+# Providers drop idle sessions after ~30 minutes (iCloud), so stay below that
+MAX_IDLE_SECONDS = 1500
+
+# imaplib reads responses through an 8 KiB buffer. A larger one saves about a
+# third of the reads on runs of short response lines (ENVELOPE/BODYSTRUCTURE
+# batches); literals are read per TLS record (at most 16 KiB) either way
+READ_BUFFER_SIZE = 256 * 1024
+
+# Servers end IDLE after 30 minutes of inactivity (RFC 2177), so re-issue it earlier
+IDLE_TIMEOUT = 29 * 60
+
+_EXISTS_RE = re.compile(rb'\* \d+ EXISTS')
+
+# Idle sessions keyed by (server, username), with the time they were released
+_POOL: Dict[Tuple[str, str], List[Tuple[imaplib.IMAP4_SSL, float]]] = {}
+_POOL_LOCK = threading.Lock()
+
+
+def _is_alive(
+    imap_session: imaplib.IMAP4_SSL
+) -> bool:
+    """
+    Checks with a NOOP whether a pooled IMAP session is still usable.
+    """
+    try:
+        typ, _data = imap_session.noop()
+    except (imaplib.IMAP4.error, OSError):
+        return False
+    return typ == 'OK'
+
+
+def _logout_quietly(
+    imap_session: imaplib.IMAP4_SSL
+) -> None:
+    """
+    Logs out of an IMAP session, ignoring errors from already dropped connections.
+    """
+    try:
+        imap_session.logout()
+    except (imaplib.IMAP4.error, OSError):
+        pass
+
+
+def _abandon_session(
+    imap_session: imaplib.IMAP4_SSL
+) -> None:
+    """
+    Closes the connection of a session in an unknown protocol state without
+    sending any command, and marks it as logged out so it is never reused.
+    """
+    imap_session.state = 'LOGOUT'
+    try:
+        imap_session.shutdown()
+    except OSError:
+        pass
+
+
+def _checkout_pooled_session(
+    key: Tuple[str, str],
+    max_idle_seconds: float
+) -> Optional[imaplib.IMAP4_SSL]:
+    """
+    Takes a usable idle session for key out of the pool, discarding stale ones.
+    """
+    while True:
+        with _POOL_LOCK:
+            idle_sessions = _POOL.get(key)
+            if not idle_sessions:
+                return None
+            imap_session, released_at = idle_sessions.pop()
+        if time.monotonic() - released_at < max_idle_seconds and _is_alive(imap_session):
+            return imap_session
+        _logout_quietly(imap_session)
 
 
 def connect_to_imap_server(
     server: str,
     username: str,
-    password: str
+    password: str,
+    max_idle_seconds: float = MAX_IDLE_SECONDS
 ) -> Optional[imaplib.IMAP4_SSL]:
     """
     Establishes a secure IMAP connection to the specified server using the provided credentials.
 
+    Sessions released with close_imap_session are kept in a pool keyed by
+    (server, username) and reused here, skipping the TLS handshake and LOGIN.
+    A pooled session is only handed out to one caller at a time.
+
     Parameters:
     - server (str): The address of the IMAP server to connect to.
     - username (str): The username for authentication.
     - password (str): The password for authentication.
+    - max_idle_seconds (float): Pooled sessions idle for longer than this are discarded.
 
     Returns:
     - imaplib.IMAP4_SSL object if connection and login are successful, None otherwise.
     """
+    key = (server, username)
+    imap_session = _checkout_pooled_session(key, max_idle_seconds)
+    if imap_session:
+        logger.info("Reusing pooled IMAP connection")
+        return imap_session
+
     try:
         imap_session = imaplib.IMAP4_SSL(server)
         typ, account_details = imap_session.login(username, password)
         if typ != 'OK':
-            logging.error('Not able to sign in!')
+            logger.error('Not able to sign in!')
             return None
-        logging.info("IMAP connection successful")
+        # Servers often advertise extensions (e.g. X-GM-EXT-1) only after login
+        typ, capabilities = imap_session.capability()
+        if typ == 'OK' and capabilities[-1]:
+            imap_session.capabilities = tuple(
+                capabilities[-1].decode().upper().split())
+        # Nothing is pending after the CAPABILITY response, so the buffered
+        # reader can be swapped without losing data
+        imap_session.file.close()
+        imap_session.file = imap_session.sock.makefile('rb', buffering=READ_BUFFER_SIZE)
+        imap_session._pool_key = key
+        logger.info("IMAP connection successful")
         return imap_session
     except imaplib.IMAP4.error as e:
-        logging.error(f"IMAP login error: {e}")
+        logger.error("IMAP login error: %s", e)
         return None
 
 
@@ -42,10 +140,162 @@ def close_imap_session(
     imap_session: imaplib.IMAP4_SSL
 ) -> None:
     """
-    Closes the IMAP session securely.
+    Releases the IMAP session back to the connection pool.
+
+    The session stays logged in for reuse by connect_to_imap_server; pooled
+    sessions are logged out when the process exits.
 
     Parameters:
     - imap_session (imaplib.IMAP4_SSL object): The IMAP session to close.
     """
-    if imap_session:
-        imap_session.logout()
+    if not imap_session or imap_session.state == 'LOGOUT':
+        return
+    key = getattr(imap_session, '_pool_key', None)
+    if key is None:
+        _logout_quietly(imap_session)
+        return
+    with _POOL_LOCK:
+        _POOL.setdefault(key, []).append((imap_session, time.monotonic()))
+
+
+def _peek_response(
+    imap_session: imaplib.IMAP4_SSL
+) -> Optional[bytes]:
+    """
+    Returns the response bytes the session can read without blocking: those
+    already in its buffered reader, or else what one socket read returns.
+
+    Returns:
+    - The available bytes, b'' at end of stream, or None if nothing has arrived.
+    """
+    sock = imap_session.socket()
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return imap_session.file.peek(1)
+    except (ssl.SSLWantReadError, BlockingIOError):
+        return None
+    finally:
+        sock.settimeout(timeout)
+
+
+def _read_line(
+    imap_session: imaplib.IMAP4_SSL,
+    deadline: Optional[float]
+) -> Optional[bytes]:
+    """
+    Reads one response line through the session's buffered reader, giving up at
+    deadline if no line has started by then.
+
+    Responses are read through imap_session.file rather than the raw socket, so
+    data imaplib already buffered is seen here and data following the IDLE
+    reply is left for imaplib.
+
+    Returns:
+    - The line including its CRLF, or None if the deadline passed first.
+    """
+    sock = imap_session.socket()
+    readable = False
+    while True:
+        available = _peek_response(imap_session)
+        if available:
+            line = imap_session.file.readline()
+            if not line.endswith(b'\n'):
+                raise imaplib.IMAP4.abort("socket closed by server during IDLE")
+            return line
+        # A readable plain socket with nothing to read has reached end of stream
+        if available == b'' and readable:
+            raise imaplib.IMAP4.abort("socket closed by server during IDLE")
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        readable = bool(select.select([sock], [], [], timeout)[0])
+        if not readable:
+            return None
+
+
+def _is_new_emails(
+    line: bytes
+) -> bool:
+    """
+    Checks an untagged response received around IDLE for new emails.
+
+    Raises imaplib.IMAP4.abort if the server is closing the connection.
+    """
+    if line.startswith(b'* BYE'):
+        raise imaplib.IMAP4.abort(line.strip().decode('utf-8', errors='replace'))
+    return bool(_EXISTS_RE.match(line))
+
+
+def wait_for_new_emails(
+    imap_session: imaplib.IMAP4_SSL,
+    timeout: float = IDLE_TIMEOUT
+) -> bool:
+    """
+    Waits in IMAP IDLE (RFC 2177) until the server reports new emails in the
+    selected mailbox or the timeout elapses.
+
+    imaplib has no IDLE support, so the command is sent and its responses are
+    read directly through the session's reader. Servers without IDLE are
+    polled once after the timeout instead.
+
+    Parameters:
+    - imap_session (imaplib.IMAP4_SSL object): A session with a mailbox selected.
+    - timeout (float): Seconds to wait before ending IDLE.
+
+    Returns:
+    - True if new emails may have arrived, False if the timeout elapsed quietly.
+    """
+    if 'IDLE' not in imap_session.capabilities:
+        time.sleep(timeout)
+        return True
+
+    tag = imap_session._new_tag()
+    imap_session.send(tag + b' IDLE\r\n')
+    completed = False
+    new_emails = False
+    try:
+        # Untagged responses (e.g. a pending EXISTS) may precede the continuation
+        while True:
+            line = _read_line(imap_session, None)
+            if line.startswith(b'+'):
+                break
+            if not line.startswith(b'*'):
+                completed = line.startswith(tag)
+                raise imaplib.IMAP4.error(f"IDLE rejected: {line.strip()!r}")
+            new_emails = _is_new_emails(line) or new_emails
+
+        deadline = time.monotonic() + timeout
+        while not new_emails:
+            line = _read_line(imap_session, deadline)
+            if line is None:
+                break
+            new_emails = _is_new_emails(line)
+
+        imap_session.send(b'DONE\r\n')
+        while True:
+            line = _read_line(imap_session, None)
+            if line.startswith(tag):
+                break
+            new_emails = _is_new_emails(line) or new_emails
+        completed = True
+        if not line[len(tag):].lstrip().startswith(b'OK'):
+            raise imaplib.IMAP4.error(f"IDLE failed: {line.strip()!r}")
+        return new_emails
+    finally:
+        imap_session.tagged_commands.pop(tag, None)
+        if not completed:
+            # Interrupted (e.g. Ctrl-C) or failed while the server may still be
+            # in IDLE: the session can't take commands, so never pool it
+            _abandon_session(imap_session)
+
+
+@atexit.register
+def close_all_imap_sessions() -> None:
+    """
+    Logs out of every pooled IMAP session.
+    """
+    with _POOL_LOCK:
+        idle_sessions = [imap_session for sessions in _POOL.values()
+                         for imap_session, _released_at in sessions]
+        _POOL.clear()
+    for imap_session in idle_sessions:
+        _logout_quietly(imap_session)
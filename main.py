@@ -1,5 +1,8 @@
-from connect_to_imap_server import connect_to_imap_server, close_imap_session
-from search_emails import search_emails, get_attachments_info, list_mailboxes
+from connect_to_imap_server import connect_to_imap_server, close_imap_session, wait_for_new_emails
+from search_emails import search_emails_since, search_new_emails, get_attachments_info, list_mailboxes
+from scan_state import load_scan_state, save_scan_state, SEARCH_STATE, WATCH_STATE
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 import logging
 import os
 from dotenv import load_dotenv
@@ -11,59 +14,163 @@ load_dotenv()
 # Configure logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 # Constants
 USERNAME = os.environ['EMAIL_USERNAME']
 PASSWORD = os.environ['EMAIL_PASSWORD']
 IMAP_SERVER = os.environ['IMAP_SERVER']
-MAILBOX = "INBOX"  # Specify the mailbox to search in
+MAILBOXES = ["INBOX"]  # Specify the mailboxes to search in, or None for all of them
+MAX_CONNECTIONS = 10  # Simultaneous IMAP connections (servers evict beyond ~15)
 START_DATE = "01-Mar-2024"  # Define the start date of the email search range
 END_DATE = "04-Mar-2024"  # Define the end date of the email search range
 FILE_EXTENSION = ".pdf"  # Specify the file extension of attachments to search for
+WATCH_MAILBOX = None  # Set to a mailbox name to keep watching it for new emails after the search
+INCREMENTAL_SEARCH = False  # Only search emails that arrived since the previous run
+STATE_FILE = "scan_state.json"  # Where the last scanned UID of each mailbox is kept, per mode
+
+
+def scan_mailbox(
+    mailbox: str,
+    mailbox_state: Optional[Dict[str, int]] = None
+) -> Tuple[List[Tuple[str, str, str]], Dict[str, int]]:
+    """
+    Searches one mailbox on its own (pooled) IMAP connection and returns
+    information about attachments with the specified file extension,
+    along with the mailbox's scan state for the next incremental search.
+    """
+    imap_session = connect_to_imap_server(IMAP_SERVER, USERNAME, PASSWORD)
+    if not imap_session:
+        raise imaplib.IMAP4.error("Failed to connect to IMAP server.")
+    try:
+        email_ids, mailbox_state = search_emails_since(
+            imap_session, mailbox, START_DATE, END_DATE, FILE_EXTENSION, mailbox_state)
+        if not email_ids:
+            logger.info(
+                "No emails with attachments found in %s in the specified date range.", mailbox)
+            return [], mailbox_state
+        return get_attachments_info(imap_session, email_ids, FILE_EXTENSION), mailbox_state
+    finally:
+        close_imap_session(imap_session)
 
 
 def main():
     """
     Connects to the IMAP server, lists all available mailboxes,
-    searches for emails within a specified date range in a specified mailbox,
+    searches for emails within a specified date range in the specified mailboxes,
     retrieves information about attachments with a specified file extension,
     and logs details of found attachments.
+
+    With INCREMENTAL_SEARCH, each mailbox is only searched for emails that
+    arrived since the previous run, as recorded in STATE_FILE.
+
+    Mailboxes are scanned concurrently, each on its own connection from the
+    connection pool, with at most MAX_CONNECTIONS connections open at a time.
     """
     imap_session = None
     try:
         imap_session = connect_to_imap_server(IMAP_SERVER, USERNAME, PASSWORD)
         if not imap_session:
-            logging.error("Failed to connect to IMAP server.")
+            logger.error("Failed to connect to IMAP server.")
             return
 
         # Call the list_mailboxes function to list all available mailboxes
-        logging.info("Listing all available mailboxes:")
-        list_mailboxes(imap_session)
-
-        email_ids = search_emails(imap_session, MAILBOX, START_DATE, END_DATE)
-        if not email_ids:
-            logging.info("No emails found in the specified date range.")
+        logger.info("Listing all available mailboxes:")
+        mailboxes = list_mailboxes(imap_session)
+        if mailboxes is None:
+            # Without a listing, search the specified mailboxes as they are
+            mailboxes = list(MAILBOXES) if MAILBOXES is not None else ["INBOX"]
+        elif MAILBOXES is not None:
+            mailboxes = [mailbox for mailbox in MAILBOXES if mailbox in mailboxes]
+        # Release the session so the first worker can reuse it
+        close_imap_session(imap_session)
+        imap_session = None
+        if not mailboxes:
+            logger.info("None of the specified mailboxes were found.")
             return
 
-        attachments_info = get_attachments_info(
-            imap_session, email_ids, FILE_EXTENSION)
+        state = load_scan_state(STATE_FILE, SEARCH_STATE) if INCREMENTAL_SEARCH else {}
+        attachments_info = []
+        with ThreadPoolExecutor(max_workers=min(MAX_CONNECTIONS, len(mailboxes))) as executor:
+            futures = {executor.submit(scan_mailbox, mailbox, state.get(mailbox)): mailbox
+                       for mailbox in mailboxes}
+            for future in as_completed(futures):
+                try:
+                    mailbox_attachments, state[futures[future]] = future.result()
+                    attachments_info.extend(mailbox_attachments)
+                except imaplib.IMAP4.error as imap_error:
+                    logger.error(
+                        "IMAP error occurred in %s: %s", futures[future], imap_error)
+                except OSError as connection_error:
+                    logger.error(
+                        "Connection error occurred in %s: %s", futures[future], connection_error)
+        if INCREMENTAL_SEARCH:
+            save_scan_state(STATE_FILE, SEARCH_STATE, state)
         if not attachments_info:
-            logging.info(
+            logger.info(
                 "No attachments found matching the specified file extension.")
             return
 
         for subject, from_, file_name in attachments_info:
-            logging.info(
-                f"Found attachment: {file_name}, From: {from_}, Subject: \"{subject}\"")
+            logger.info(
+                "Found attachment: %s, From: %s, Subject: \"%s\"", file_name, from_, subject)
+
+    except imaplib.IMAP4.error as imap_error:
+        logger.error("IMAP error occurred: %s", imap_error)
+    except Exception as general_error:
+        logger.error("An unexpected error occurred: %s", general_error)
+    finally:
+        if imap_session:
+            close_imap_session(imap_session)
+
+
+def watch(
+    mailbox: str
+) -> None:
+    """
+    Keeps watching a mailbox with IMAP IDLE and logs details of attachments with
+    the specified file extension in new emails as they arrive.
+
+    Only emails above the UIDNEXT the watch recorded in STATE_FILE are fetched,
+    so a restarted watch picks up where the previous one stopped. Incremental
+    searches keep their own state there and never move it.
+    """
+    state = load_scan_state(STATE_FILE, WATCH_STATE)
+    imap_session = None
+    try:
+        imap_session = connect_to_imap_server(IMAP_SERVER, USERNAME, PASSWORD)
+        if not imap_session:
+            logger.error("Failed to connect to IMAP server.")
+            return
+
+        logger.info("Watching %s for new emails.", mailbox)
+        while True:
+            email_ids, mailbox_state = search_new_emails(
+                imap_session, mailbox, state.get(mailbox))
+            if email_ids:
+                for subject, from_, file_name in get_attachments_info(
+                        imap_session, email_ids, FILE_EXTENSION):
+                    logger.info(
+                        "Found attachment: %s, From: %s, Subject: \"%s\"", file_name, from_, subject)
+            # Only advance past the new emails once they have been scanned
+            state[mailbox] = mailbox_state
+            save_scan_state(STATE_FILE, WATCH_STATE, state)
+            while not wait_for_new_emails(imap_session):
+                pass
 
+    except KeyboardInterrupt:
+        logger.info("Stopped watching %s.", mailbox)
     except imaplib.IMAP4.error as imap_error:
-        logging.error(f"IMAP error occurred: {imap_error}")
+        logger.error("IMAP error occurred: %s", imap_error)
     except Exception as general_error:
-        logging.error(f"An unexpected error occurred: {general_error}")
+        logger.error("An unexpected error occurred: %s", general_error)
     finally:
+        save_scan_state(STATE_FILE, WATCH_STATE, state)
         if imap_session:
             close_imap_session(imap_session)
 
 
 if __name__ == "__main__":
     main()
+    if WATCH_MAILBOX:
+        watch(WATCH_MAILBOX)
@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Sections of the state file. A date-range search records the server's UIDNEXT
+# even for emails outside the range, while a watch records the first UID it has
+# not reported yet, so each keeps its own state.
+SEARCH_STATE = "search"
+WATCH_STATE = "watch"
+
+
+def _read_state_file(
+    path: str
+) -> Dict[str, Dict[str, Dict[str, int]]]:
+    """
+    Reads the whole state file, empty if there is no usable one.
+    """
+    try:
+        with open(path, encoding='utf-8') as state_file:
+            state = json.load(state_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable scan state %s: %s", path, e)
+        return {}
+    if not isinstance(state, dict):
+        logger.warning("Ignoring unreadable scan state %s.", path)
+        return {}
+    return state
+
+
+def load_scan_state(
+    path: str,
+    section: str
+) -> Dict[str, Dict[str, int]]:
+    """
+    Loads the per-mailbox scan state saved by a previous run.
+
+    Parameters:
+    - path (str): The JSON file the state is kept in.
+    - section (str): SEARCH_STATE or WATCH_STATE.
+
+    Returns:
+    - A dict mapping mailbox names to their state (e.g. UIDVALIDITY and UIDNEXT),
+      empty if there is no usable saved state.
+    """
+    state = _read_state_file(path).get(section)
+    return state if isinstance(state, dict) else {}
+
+
+def save_scan_state(
+    path: str,
+    section: str,
+    state: Dict[str, Dict[str, int]]
+) -> None:
+    """
+    Saves the per-mailbox scan state of one section, keeping the other sections,
+    and replaces the file atomically so an interrupted write never leaves a
+    truncated state behind.
+
+    Parameters:
+    - path (str): The JSON file the state is kept in.
+    - section (str): SEARCH_STATE or WATCH_STATE.
+    - state (dict): The state as returned by load_scan_state.
+    """
+    sections = _read_state_file(path)
+    sections[section] = state
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as state_file:
+        json.dump(sections, state_file, indent=2)
+    os.replace(temporary_path, path)
@@ -1,74 +1,333 @@
-from typing import List, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple, Optional, Union
 from email.header import decode_header, make_header
-import email
+from email.utils import decode_rfc2231
+from itertools import islice, takewhile
 from datetime import datetime, timedelta
+import binascii
+import functools
 import logging
 import imaplib
+import re
+from urllib.parse import quote_from_bytes, unquote
 
-# Logging configuration
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 DATE_FORMAT = "%d-%b-%Y"
+BATCH_SIZE = 100  # Number of message IDs requested per FETCH command
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes of an attachment requested per FETCH
+PROGRESS_LOG_INTERVAL = 100  # Number of emails processed between progress log lines
+
+# Tokens of an IMAP FETCH response: parentheses, quoted strings and atoms.
+# Atoms may carry a bracketed section, e.g. BODY[HEADER.FIELDS (SUBJECT)].
+_TOKEN_RE = re.compile(rb'''
+    \s*(?:
+        (?P<open>\()
+      | (?P<close>\))
+      | "(?P<quoted>(?:[^"\\]|\\.)*)"
+      | (?P<atom>(?=[^\s()"])[^\s()"\[]*(?:\[[^\]]*\][^\s()"]*)?)
+    )''', re.VERBOSE)
+_QUOTED_ESCAPE_RE = re.compile(rb'\\(.)')
+_LITERAL_RE = re.compile(rb'\{\d+\}$')
+_MAILBOX_SPECIALS_RE = re.compile(r'[\s(){%*"\\\]]')
+_ENCODED_WORD_RE = re.compile(r'=\?[^?]+\?[BbQq]\?')
+_ENCODED_WORD_BYTES_RE = re.compile(rb'=\?[^?]+\?[BbQq]\?')
+_WHITESPACE_RE = re.compile(rb'\s+')
+_CONTINUATION_RE = re.compile(rb'(?P<name>[^*]+)\*(?P<index>\d+)(?P<extended>\*)?')
+_OPEN = object()
+_CLOSE = object()
 
 
 def validate_date_range(
     start_date: str,
     end_date: str,
     date_format: str
-) -> None:
+) -> Tuple[datetime, datetime]:
     """
     Validates that the start_date is before the end_date according to the given date format.
+
+    Returns:
+    - The parsed (start, end) datetimes, so callers don't have to parse them again.
     """
     start = datetime.strptime(start_date, date_format)
     end = datetime.strptime(end_date, date_format)
     if start >= end:
         raise ValueError("start_date must be before end_date")
+    return start, end
+
+
+def _attachment_criteria(
+    imap_session: imaplib.IMAP4_SSL,
+    file_extension: str
+) -> Optional[str]:
+    """
+    Returns a SEARCH key narrowing the search to emails with attachments of the
+    given file extension, if the server supports one.
+
+    Gmail (X-GM-EXT-1) can match attachment file names through X-GM-RAW. Other
+    servers get no extra key: a Content-Type header filter would miss
+    single-part and multipart/signed emails, so the file name check is left to
+    get_attachments_info.
+    """
+    if 'X-GM-EXT-1' in imap_session.capabilities:
+        extension = file_extension.lstrip('.')
+        return f'X-GM-RAW "has:attachment filename:{extension}"'
+    return None
+
+
+@functools.lru_cache(maxsize=128)
+def _search_criteria(
+    start_date: str,
+    end_date: str,
+    attachment_criteria: Optional[str],
+    min_uid: Optional[int]
+) -> bytes:
+    """
+    Builds the encoded SEARCH criteria for a date range (validated here) and
+    optional extra keys. Cached, since multi-mailbox scans search every mailbox
+    with the same criteria.
+    """
+    start, end = validate_date_range(start_date, end_date, DATE_FORMAT)
+    since_date = start.strftime(DATE_FORMAT)
+    before_date = (end + timedelta(days=1)).strftime(DATE_FORMAT)
+    criteria = f'SINCE "{since_date}" BEFORE "{before_date}"'
+    if attachment_criteria:
+        criteria += f' {attachment_criteria}'
+    if min_uid:
+        criteria += f' UID {min_uid}:*'
+    return f'({criteria})'.encode('ascii')
 
 
 def search_emails(
     imap_session: imaplib.IMAP4_SSL,
     mailbox: str,
     start_date: str,
-    end_date: str
+    end_date: str,
+    file_extension: Optional[str] = None,
+    min_uid: Optional[int] = None
 ) -> List[str]:
     """
     Searches for emails within a given date range in the specified mailbox.
+
+    If file_extension is given and the server supports it, the search is
+    narrowed on the server to emails carrying such an attachment (see
+    _attachment_criteria). If min_uid
+    is given, only emails with that UID or above are searched.
+
+    Returns:
+    - The UIDs of the matching emails.
     """
-    validate_date_range(start_date, end_date, DATE_FORMAT)
-    imap_session.select(mailbox)
+    attachment_criteria = (
+        _attachment_criteria(imap_session, file_extension) if file_extension else None)
+    criteria = _search_criteria(start_date, end_date, attachment_criteria, min_uid)
+    if not _select_mailbox(imap_session, mailbox):
+        logger.error("Failed to select mailbox %s.", mailbox)
+        return []
 
-    since_date = datetime.strptime(
-        start_date, DATE_FORMAT).strftime(DATE_FORMAT)
-    before_date = (datetime.strptime(end_date, DATE_FORMAT) +
-                   timedelta(days=1)).strftime(DATE_FORMAT)
-    typ, data = imap_session.search(
-        None, f'(SINCE "{since_date}" BEFORE "{before_date}")')
-    if typ != 'OK':
-        logging.error(
+    uids = _uid_search(imap_session, criteria)
+    if uids is None:
+        logger.error(
             'Error searching Inbox. IMAP search did not return "OK".')
         return []
+    # "n:*" always matches the highest UID, even when it is below n
+    return [str(uid) for uid in uids if uid >= (min_uid or 0)]
+
+
+def search_emails_since(
+    imap_session: imaplib.IMAP4_SSL,
+    mailbox: str,
+    start_date: str,
+    end_date: str,
+    file_extension: Optional[str] = None,
+    mailbox_state: Optional[Dict[str, int]] = None
+) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Searches for emails within a given date range, like search_emails, but only
+    among emails added since the search that returned mailbox_state.
+
+    The server then only looks at the UID range above the UIDNEXT recorded in
+    mailbox_state instead of the whole mailbox. Without a usable state (first
+    run, or UIDVALIDITY changed) the whole date range is searched.
+
+    Returns:
+    - The UIDs of the matching emails and the state to pass to the next call.
+    """
+    if not _select_mailbox(imap_session, mailbox):
+        logger.error("Failed to select mailbox %s.", mailbox)
+        return [], mailbox_state or {}
+    uid_validity = imap_session._uid_validity
+    min_uid = None
+    if mailbox_state and mailbox_state.get('uidvalidity') == uid_validity:
+        min_uid = mailbox_state['uidnext']
+
+    email_ids = search_emails(
+        imap_session, mailbox, start_date, end_date, file_extension, min_uid)
+    uid_next = max([min_uid or 1, imap_session._uid_next or 0] +
+                   [int(email_id) + 1 for email_id in email_ids])
+    return email_ids, {'uidvalidity': uid_validity, 'uidnext': uid_next}
+
+
+def _uid_search(
+    imap_session: imaplib.IMAP4_SSL,
+    criteria: Union[str, bytes]
+) -> Optional[List[int]]:
+    """
+    Runs a UID SEARCH in the selected mailbox and parses the result.
+
+    Servers may split long results over several SEARCH responses, which imaplib
+    returns as separate list elements, so all of them are read.
+
+    Returns:
+    - The matching UIDs, or None if the search failed.
+    """
+    typ, data = imap_session.uid('search', None, criteria)
+    if typ != 'OK':
+        return None
+    return [int(uid) for response in data if response for uid in response.split()]
 
-    # Decoding bytes to str
-    email_ids_str = [email_id.decode('utf-8') for email_id in data[0].split()]
-    return email_ids_str
+
+def _response_code_number(
+    imap_session: imaplib.IMAP4_SSL,
+    code: str
+) -> Optional[int]:
+    """
+    Returns the number carried by a response code such as [UIDNEXT 4392] from
+    the last command, or None if the server did not send it.
+    """
+    typ, data = imap_session.response(code)
+    if not data or data[-1] is None:
+        return None
+    return int(data[-1])
+
+
+def _select_mailbox(
+    imap_session: imaplib.IMAP4_SSL,
+    mailbox: str
+) -> bool:
+    """
+    Opens the mailbox read-only with EXAMINE, unless the session already has it open.
+
+    Nothing here modifies emails, so EXAMINE is enough and leaves the \\Recent flag alone.
+    Sessions come back from the connection pool with their mailbox still open,
+    so repeated scans of the same mailbox skip the round trip. The mailbox's
+    UIDVALIDITY and UIDNEXT at selection time are kept on the session too.
+
+    Returns:
+    - True if the mailbox is selected, False otherwise.
+    """
+    if (getattr(imap_session, '_selected_mailbox', None) == mailbox and
+            imap_session.state == 'SELECTED'):
+        return True
+    typ, _data = imap_session.select(_quote_mailbox(mailbox), readonly=True)
+    if typ != 'OK':
+        imap_session._selected_mailbox = None
+        return False
+    imap_session._selected_mailbox = mailbox
+    imap_session._uid_validity = _response_code_number(imap_session, 'UIDVALIDITY')
+    imap_session._uid_next = _response_code_number(imap_session, 'UIDNEXT')
+    return True
+
+
+def search_new_emails(
+    imap_session: imaplib.IMAP4_SSL,
+    mailbox: str,
+    mailbox_state: Optional[Dict[str, int]] = None
+) -> Tuple[List[str], Dict[str, int]]:
+    """
+    Searches for emails that arrived in the mailbox since a previous scan.
+
+    mailbox_state is the state returned by the previous call (see scan_state):
+    the mailbox's UIDVALIDITY and the UIDNEXT seen at that time. Only UIDs from
+    that UIDNEXT on are searched, which is a cheap range lookup on the server.
+    Without a usable state (first run, or UIDVALIDITY changed) nothing is
+    returned and scanning starts from the UIDNEXT seen when the mailbox was
+    selected.
+
+    Returns:
+    - The UIDs of the new emails and the state to pass to the next call.
+    """
+    if not _select_mailbox(imap_session, mailbox):
+        logger.error("Failed to select mailbox %s.", mailbox)
+        return [], mailbox_state or {}
+    uid_validity = imap_session._uid_validity
+    uid_next = imap_session._uid_next
+
+    if not mailbox_state or mailbox_state.get('uidvalidity') != uid_validity:
+        logger.info("No previous scan of %s, watching for new emails from now on.", mailbox)
+        if uid_next is None:
+            # Servers that omit UIDNEXT: continue after the highest UID instead
+            highest_uids = _uid_search(imap_session, 'UID *')
+            uid_next = max(highest_uids) + 1 if highest_uids else 1
+        return [], {'uidvalidity': uid_validity, 'uidnext': uid_next}
+
+    last_uid_next = mailbox_state['uidnext']
+    uids = _uid_search(imap_session, f'UID {last_uid_next}:*')
+    if uids is None:
+        logger.error('Error searching %s. IMAP search did not return "OK".', mailbox)
+        return [], mailbox_state
+
+    # "n:*" always matches the highest UID, even when it is below n
+    uids = [uid for uid in uids if uid >= last_uid_next]
+    next_uid = max([last_uid_next, uid_next or 0] + [uid + 1 for uid in uids])
+    return [str(uid) for uid in uids], {'uidvalidity': uid_validity, 'uidnext': next_uid}
+
+
+def _quote_mailbox(
+    mailbox: str
+) -> str:
+    """
+    Quotes a mailbox name for use as a command argument if it is not a plain atom.
+    """
+    if mailbox and not _MAILBOX_SPECIALS_RE.search(mailbox):
+        return mailbox
+    return '"' + mailbox.replace('\\', '\\\\').replace('"', '\\"') + '"'
 
 
 def list_mailboxes(
     imap_session: imaplib.IMAP4_SSL
-) -> None:
+) -> Optional[List[str]]:
     """
     Lists all mailboxes (folders) available in the email account.
+
+    Returns:
+    - The names of the mailboxes that can be selected, as expected by search_emails,
+      or None if the mailboxes could not be listed.
     """
     typ, mailboxes = imap_session.list()
-    if typ == 'OK':
-        logging.info("Mailboxes available:")
-        for mailbox in mailboxes:
-            mailbox_name = str(make_header(decode_header(
-                mailbox.decode().split(' \"/\" ')[1])))
-            logging.info(f"- {mailbox_name}")
-    else:
-        logging.error("Failed to list mailboxes.")
+    if typ != 'OK':
+        logger.error("Failed to list mailboxes.")
+        return None
+
+    logger.info("Mailboxes available:")
+    mailbox_names = []
+    for mailbox in mailboxes:
+        if isinstance(mailbox, tuple):
+            # Names containing special characters are sent as literals
+            flags, name = mailbox[0], mailbox[1]
+        elif not mailbox:
+            # imaplib adds an empty element after each literal
+            continue
+        else:
+            flags, _, name = mailbox.partition(b') ')
+            name = name.split(b' ', 1)[1] if b' ' in name else name
+            if name.startswith(b'"') and name.endswith(b'"'):
+                name = _QUOTED_ESCAPE_RE.sub(rb'\1', name[1:-1])
+        mailbox_name = name.decode('utf-8', errors='replace')
+        logger.info("- %s", decode_text(mailbox_name))
+        if b'\\NOSELECT' not in flags.upper():
+            mailbox_names.append(mailbox_name)
+    return mailbox_names
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode_encoded_words(
+    text: str
+) -> str:
+    """
+    Decodes the RFC 2047 encoded words in a header value. Cached, since bulk
+    scans see the same senders and subjects over and over.
+    """
+    return str(make_header(decode_header(text)))
 
 
 def decode_text(
@@ -86,53 +345,489 @@ def decode_text(
     - The decoded text as a string.
     """
     if text is None:
-        logging.warning("decode_text received None instead of string/bytes.")
+        logger.warning("decode_text received None instead of string/bytes.")
         return ""
 
+    if isinstance(text, bytes):
+        text = text.decode(default_charset, errors='replace')
+    # Headers without RFC 2047 encoded words need no decoding
+    if not _ENCODED_WORD_RE.search(text):
+        return text
+
     decoded_string = ""
     try:
-        if isinstance(text, bytes):
-            decoded_header = decode_header(text)
-            decoded_string = str(make_header(decoded_header))
-        else:
-            decoded_string = text
+        decoded_string = _decode_encoded_words(text)
     except Exception as e:
-        logging.error(
-            f"Error decoding text: {e}, using default charset {default_charset}.")
-        decoded_string = text.decode(
-            default_charset, errors='replace') if isinstance(text, bytes) else text
+        logger.error(
+            "Error decoding text: %s, using default charset %s.", e, default_charset)
+        decoded_string = text
 
     return decoded_string
 
 
+def _chunks(
+    seq: Iterable[str],
+    n: int
+) -> Iterator[List[str]]:
+    """
+    Yields successive lists of at most n items from seq.
+    """
+    iterator = iter(seq)
+    while True:
+        chunk = list(islice(iterator, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _fetch_batch(
+    imap_session: imaplib.IMAP4_SSL,
+    batch: List[str],
+    message_parts: str
+) -> list:
+    """
+    Fetches message_parts for a batch of email UIDs with a single UID FETCH command.
+
+    Servers reject overly long commands (e.g. "BAD [parse error: maximum request
+    size exceeded]"), in which case the batch is split in half and retried.
+    Any other failure raises imaplib.IMAP4.error, so an email that could not be
+    fetched is never counted as scanned.
+
+    Returns:
+    - The raw response data of the FETCH command(s).
+    """
+    try:
+        typ, data = imap_session.uid('fetch', ",".join(batch), message_parts)
+    except imaplib.IMAP4.abort:
+        raise
+    except imaplib.IMAP4.error as e:
+        if len(batch) == 1:
+            raise imaplib.IMAP4.error(f"Failed to fetch email ID {batch[0]}: {e}") from e
+        half = len(batch) // 2
+        logger.warning(
+            "FETCH of %d emails rejected (%s), retrying in batches of %d.", len(batch), e, half)
+        return (_fetch_batch(imap_session, batch[:half], message_parts) +
+                _fetch_batch(imap_session, batch[half:], message_parts))
+    if typ != 'OK':
+        raise imaplib.IMAP4.error(
+            f"Failed to fetch email IDs {batch[0]}-{batch[-1]}: {data[-1]!r}")
+    return data
+
+
+def _tokenize(
+    data: bytes
+) -> Iterator[object]:
+    """
+    Splits raw IMAP response bytes into parentheses markers, strings and atoms.
+    """
+    for match in _TOKEN_RE.finditer(data):
+        if match.group('open') is not None:
+            yield _OPEN
+        elif match.group('close') is not None:
+            yield _CLOSE
+        elif match.group('quoted') is not None:
+            yield _QUOTED_ESCAPE_RE.sub(rb'\1', match.group('quoted'))
+        else:
+            atom = match.group('atom')
+            yield None if atom.upper() == b'NIL' else atom
+
+
+def _parse_fetch_response(
+    data: list,
+    by_uid: bool = True
+) -> Dict[str, Dict[bytes, object]]:
+    """
+    Parses the raw data returned by imaplib's fetch() or uid('fetch') into
+    nested lists.
+
+    imaplib returns each message literal as a (prefix, literal) tuple, with the
+    rest of the response following in the next list element, so the pieces are
+    tokenized as one stream and literals are spliced in where they occurred.
+
+    Parameters:
+    - data (list): The response data of the FETCH command.
+    - by_uid (bool): Whether the data comes from UID FETCH. Responses without
+      a UID item are then unsolicited (e.g. flag updates) and skipped;
+      otherwise emails are keyed by sequence number.
+
+    Returns:
+    - A dict mapping each email's UID (or sequence number) to a dict of its
+      FETCH items, keyed by the upper-cased item name (e.g. b'ENVELOPE',
+      b'BODYSTRUCTURE').
+    """
+    def tokens() -> Iterator[object]:
+        for item in data:
+            if isinstance(item, tuple):
+                yield from _tokenize(_LITERAL_RE.sub(b'', item[0]))
+                yield item[1]
+            elif item:
+                yield from _tokenize(item)
+
+    stack: List[list] = [[]]
+    for token in tokens():
+        if token is _OPEN:
+            stack.append([])
+        elif token is _CLOSE:
+            completed = stack.pop()
+            stack[-1].append(completed)
+        else:
+            stack[-1].append(token)
+
+    responses: Dict[str, Dict[bytes, object]] = {}
+    top_level = stack[0]
+    for sequence_number, items in zip(top_level[::2], top_level[1::2]):
+        fetch_items = {name.upper(): value
+                       for name, value in zip(items[::2], items[1::2])}
+        if not by_uid:
+            email_id = sequence_number.decode()
+        elif fetch_items.get(b'UID'):
+            email_id = fetch_items[b'UID'].decode()
+        else:
+            continue
+        responses.setdefault(email_id, {}).update(fetch_items)
+    return responses
+
+
+def _fetch_batches(
+    imap_session: imaplib.IMAP4_SSL,
+    email_ids: List[str],
+    message_parts: str
+) -> Iterator[list]:
+    """
+    Yields the FETCH response data for email_ids, one batch of BATCH_SIZE at a time.
+
+    The next batch is already requested on a background thread while the caller
+    processes the current one, so parsing overlaps with waiting for the server.
+    The session is only used from that thread until the generator is exhausted.
+    """
+    with ThreadPoolExecutor(max_workers=1) as fetcher:
+        pending = None
+        for batch in _chunks(email_ids, BATCH_SIZE):
+            future = fetcher.submit(_fetch_batch, imap_session, batch, message_parts)
+            if pending is not None:
+                yield pending.result()
+            pending = future
+        if pending is not None:
+            yield pending.result()
+
+
+def _format_addresses(
+    addresses: Optional[list]
+) -> str:
+    """
+    Formats an ENVELOPE address list as a From-style header value.
+    """
+    formatted = []
+    for name, _route, mailbox, host in addresses or []:
+        address = "@".join(
+            part.decode('utf-8', errors='replace') for part in (mailbox, host) if part)
+        if name:
+            formatted.append(f"{decode_text(name)} <{address}>")
+        else:
+            formatted.append(address)
+    return ", ".join(formatted)
+
+
+def _body_params(
+    params: Optional[list]
+) -> Dict[bytes, bytes]:
+    """
+    Converts a BODYSTRUCTURE parameter list into a dict with lower-cased keys.
+    """
+    if not isinstance(params, list):
+        return {}
+    return {key.lower(): value for key, value in zip(params[::2], params[1::2])}
+
+
+def _decode_extended_value(
+    value: bytes
+) -> str:
+    """
+    Decodes an RFC 2231 extended parameter value (charset'language'percent-encoded).
+    """
+    charset, _language, encoded = decode_rfc2231(value.decode('ascii', errors='replace'))
+    try:
+        return unquote(encoded, encoding=charset or 'utf-8', errors='replace')
+    except LookupError:
+        return unquote(encoded, errors='replace')
+
+
+def _param_value(
+    params: Dict[bytes, bytes],
+    name: bytes
+) -> Tuple[Optional[bytes], bool]:
+    """
+    Looks up a BODYSTRUCTURE parameter as a plain value, an RFC 2231 extended
+    value (name*) or RFC 2231 continuations (name*0, name*1*, ...).
+
+    Continuations are joined into a single value; if any segment is extended,
+    plain segments are percent-encoded so the result decodes as one extended
+    value.
+
+    Returns:
+    - A (raw value, is RFC 2231 extended value) tuple; the value is None if
+      the parameter is missing or empty.
+    """
+    if params.get(name):
+        return params[name], False
+    if params.get(name + b'*'):
+        return params[name + b'*'], True
+
+    segments = {}
+    for key, value in params.items():
+        match = _CONTINUATION_RE.fullmatch(key)
+        if match and match.group('name') == name and value is not None:
+            segments[int(match.group('index'))] = (value, match.group('extended') is not None)
+    if 0 not in segments:
+        return None, False
+    # Segments after a gap in the numbering are ignored, as in RFC 2231
+    ordered = [segments[index] for index in takewhile(segments.__contains__, range(len(segments)))]
+    if not any(extended for _value, extended in ordered):
+        return b''.join(value for value, _extended in ordered), False
+    joined = [] if ordered[0][1] else [b"''"]
+    for value, extended in ordered:
+        joined.append(value if extended else quote_from_bytes(value, safe='').encode('ascii'))
+    return b''.join(joined), True
+
+
+def _part_file_name(
+    body_structure: list
+) -> Tuple[Optional[bytes], bool]:
+    """
+    Returns the raw file name of a non-multipart BODYSTRUCTURE part if it has a
+    Content-Disposition, mirroring email.message.Message.get_filename().
+
+    Returns:
+    - A (raw file name, is RFC 2231 extended value) tuple; the name is None if
+      the part has no Content-Disposition or no file name.
+    """
+    media_type = (body_structure[0] or b'').lower()
+    subtype = (body_structure[1] or b'').lower()
+    # Extension data follows the basic fields (7), text lines (1) and, for
+    # message/rfc822, the envelope, body and lines (3), then the MD5 field.
+    if media_type == b'text':
+        disposition_index = 9
+    elif media_type == b'message' and subtype == b'rfc822':
+        disposition_index = 11
+    else:
+        disposition_index = 8
+    if len(body_structure) <= disposition_index:
+        return None, False
+    disposition = body_structure[disposition_index]
+    if not isinstance(disposition, list):
+        return None, False
+
+    file_name = _param_value(
+        _body_params(disposition[1] if len(disposition) > 1 else None), b'filename')
+    if file_name[0]:
+        return file_name
+    return _param_value(_body_params(body_structure[2]), b'name')
+
+
+def _find_attachments(
+    body_structure: Optional[list],
+    file_extension: bytes,
+    part_number: str = ''
+) -> List[Tuple[str, str, str]]:
+    """
+    Walks a parsed BODYSTRUCTURE looking for parts with a Content-Disposition
+    whose file name ends with file_extension.
+
+    File names are compared as raw bytes, so only matching names (and encoded
+    ones whose suffix is hidden until decoded) are ever decoded. RFC 2231
+    values usually keep the extension as plain ASCII after the percent-encoded
+    part, but are decoded before being rejected if they contain any
+    percent-encoding.
+
+    Returns:
+    - A list of (part number, Content-Transfer-Encoding, file name) tuples for
+      the matching parts.
+    """
+    if not isinstance(body_structure, list) or not body_structure:
+        return []
+
+    if isinstance(body_structure[0], list):
+        # Multipart: child parts come first, followed by the subtype
+        attachments = []
+        children = takewhile(lambda child: isinstance(child, list), body_structure)
+        for index, child in enumerate(children, 1):
+            child_number = f"{part_number}.{index}" if part_number else str(index)
+            attachments.extend(
+                _find_attachments(child, file_extension, child_number))
+        return attachments
+
+    part_number = part_number or '1'
+    attachments = []
+    raw_file_name, extended = _part_file_name(body_structure)
+    if raw_file_name:
+        file_name = None
+        if extended:
+            if raw_file_name.endswith(file_extension):
+                file_name = _decode_extended_value(raw_file_name)
+            elif b'%' in raw_file_name:
+                # Encoders may percent-encode the extension as well
+                decoded_name = _decode_extended_value(raw_file_name)
+                if decoded_name.endswith(file_extension.decode()):
+                    file_name = decoded_name
+        elif _ENCODED_WORD_BYTES_RE.search(raw_file_name):
+            decoded_name = decode_text(raw_file_name)
+            if decoded_name.endswith(file_extension.decode()):
+                file_name = decoded_name
+        elif raw_file_name.endswith(file_extension):
+            file_name = decode_text(raw_file_name)
+        if file_name is not None:
+            encoding = (body_structure[5] or b'7bit').decode('ascii', errors='replace').lower()
+            attachments.append((part_number, encoding, file_name))
+
+    if ((body_structure[0] or b'').lower() == b'message' and
+            (body_structure[1] or b'').lower() == b'rfc822' and
+            len(body_structure) > 8):
+        # Parts of an attached message are numbered below the message part
+        nested = body_structure[8]
+        nested_number = part_number if isinstance(
+            nested, list) and nested and isinstance(nested[0], list) else f"{part_number}.1"
+        attachments.extend(_find_attachments(nested, file_extension, nested_number))
+    return attachments
+
+
+def get_attachment_parts(
+    imap_session: imaplib.IMAP4_SSL,
+    email_ids: List[str],
+    file_extension: str
+) -> List[Tuple[str, str, str, str, str, str]]:
+    """
+    Fetches the envelope and MIME structure of emails by UIDs in batches and
+    scans each for attachments of a specific type.
+
+    Only ENVELOPE and BODYSTRUCTURE are requested, so no message body is ever
+    downloaded: the subject and sender come from the envelope and the
+    attachment file names from the structure's Content-Disposition parameters.
+
+    Returns:
+    - A list of (UID, part number, Content-Transfer-Encoding, subject, from,
+      file name) tuples; the first three locate the attachment for
+      download_attachment.
+    """
+    attachment_parts = []
+    extension = file_extension.encode('utf-8')
+    # Per-email logging is only worth its cost when debugging
+    debug = logger.isEnabledFor(logging.DEBUG)
+    processed = 0
+    for data in _fetch_batches(imap_session, email_ids, '(ENVELOPE BODYSTRUCTURE)'):
+        for email_id, items in _parse_fetch_response(data).items():
+            if b'BODYSTRUCTURE' not in items:
+                # Unsolicited FETCH responses (e.g. flag updates) for other emails
+                continue
+            if debug:
+                logger.debug("Processing email ID: %s", email_id)
+            processed += 1
+            if processed % PROGRESS_LOG_INTERVAL == 0:
+                logger.info("Processed %d/%d emails.", processed, len(email_ids))
+            attachments = _find_attachments(
+                items.get(b'BODYSTRUCTURE'), extension)
+            if not attachments:
+                continue
+
+            envelope = items.get(b'ENVELOPE') or [None] * 10
+            subject = decode_text(envelope[1])
+            from_ = _format_addresses(envelope[2])
+            for part_number, encoding, file_name in attachments:
+                attachment_parts.append(
+                    (email_id, part_number, encoding, subject, from_, file_name))
+                if debug:
+                    logger.debug("Found attachment: %s", file_name)
+
+    logger.info(
+        "Completed processing %d emails. Found %d attachments.", processed, len(attachment_parts))
+    return attachment_parts
+
+
 def get_attachments_info(
     imap_session: imaplib.IMAP4_SSL,
     email_ids: List[str],
     file_extension: str
 ) -> List[Tuple[str, str, str]]:
     """
-    Fetches emails by IDs and scans each for attachments of a specific type.
+    Fetches emails by UIDs and scans each for attachments of a specific type.
+
+    Returns:
+    - A list of (subject, from, file name) tuples, see get_attachment_parts.
     """
-    attachments_info = []
-    for email_id in email_ids:
-        logging.info(f"Processing email ID: {email_id}")
-        typ, data = imap_session.fetch(email_id, '(RFC822)')
-        if typ != 'OK':
-            logging.error(f"Failed to fetch email ID {email_id}.")
-            continue
+    return [(subject, from_, file_name) for _email_id, _part_number, _encoding, subject, from_, file_name
+            in get_attachment_parts(imap_session, email_ids, file_extension)]
 
-        email_message = email.message_from_bytes(data[0][1])
-        subject = decode_text(email_message["subject"])
-        from_ = decode_text(email_message["from"])
 
-        for part in email_message.walk():
-            if part.get_content_maintype() == 'multipart' or part.get('Content-Disposition') is None:
-                continue
-            file_name = decode_text(part.get_filename())
-            if file_name and file_name.endswith(file_extension):
-                attachments_info.append((subject, from_, file_name))
-                logging.info(f"Found attachment: {file_name}")
-
-    logging.info(
-        f"Completed processing emails. Found {len(attachments_info)} attachments.")
-    return attachments_info
+class _TransferDecoder:
+    """
+    Incrementally decodes a Content-Transfer-Encoding over arbitrary chunks,
+    carrying incomplete base64 quanta or quoted-printable lines to the next one.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.pending = b''
+
+    def decode(self, chunk: bytes) -> bytes:
+        if self.encoding == 'base64':
+            data = self.pending + _WHITESPACE_RE.sub(b'', chunk)
+            complete = len(data) - len(data) % 4
+            self.pending = data[complete:]
+            return binascii.a2b_base64(data[:complete])
+        if self.encoding == 'quoted-printable':
+            data = self.pending + chunk
+            complete = data.rfind(b'\n') + 1
+            self.pending = data[complete:]
+            return binascii.a2b_qp(data[:complete])
+        return chunk
+
+    def flush(self) -> bytes:
+        data, self.pending = self.pending, b''
+        if not data:
+            return b''
+        if self.encoding == 'base64':
+            return binascii.a2b_base64(data + b'=' * (-len(data) % 4))
+        return binascii.a2b_qp(data)
+
+
+def download_attachment(
+    imap_session: imaplib.IMAP4_SSL,
+    email_id: str,
+    part_number: str,
+    encoding: str,
+    output: BinaryIO,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE
+) -> int:
+    """
+    Streams one attachment, as located by get_attachment_parts, into output.
+
+    The part is fetched in chunk_size slices with partial BODY.PEEK[<part>]<offset.size>
+    requests and decoded as it arrives, so memory use stays at one chunk however
+    large the attachment is and the email is not marked as seen.
+
+    Parameters:
+    - email_id (str): The UID of the email.
+    - part_number (str): The MIME part number of the attachment.
+    - encoding (str): The part's Content-Transfer-Encoding.
+    - output: A binary file object (e.g. an io.BufferedWriter) to write the decoded bytes to.
+    - chunk_size (int): The number of encoded bytes requested per FETCH.
+
+    Returns:
+    - The number of decoded bytes written.
+    """
+    decoder = _TransferDecoder(encoding)
+    written = 0
+    offset = 0
+    while True:
+        typ, data = imap_session.uid(
+            'fetch', email_id, f'(BODY.PEEK[{part_number}]<{offset}.{chunk_size}>)')
+        if typ != 'OK':
+            raise imaplib.IMAP4.error(
+                f"Failed to fetch part {part_number} of email ID {email_id}.")
+        items = _parse_fetch_response(data).get(email_id, {})
+        chunk = items.get(f'BODY[{part_number}]<{offset}>'.encode()) or b''
+        written += output.write(decoder.decode(chunk))
+        if len(chunk) < chunk_size:
+            break
+        offset += len(chunk)
+    written += output.write(decoder.flush())
+    return written
@@ -0,0 +1,117 @@
+import imaplib
+import socket
+import threading
+import unittest
+
+from connect_to_imap_server import wait_for_new_emails
+
+
+class _PairedIMAP4(imaplib.IMAP4):
+    """
+    An imaplib session talking over one end of a socket pair.
+    """
+
+    def __init__(self, sock):
+        self._paired_socket = sock
+        super().__init__()
+
+    def open(self, host='', port=imaplib.IMAP4_PORT, timeout=None):
+        self.sock = self._paired_socket
+        self.file = self.sock.makefile('rb')
+
+
+class _ScriptedServer(threading.Thread):
+    """
+    Plays the server side of an IMAP exchange. For each (command, reply) step
+    it waits for a client line ending with command, then sends reply with
+    {tag} replaced by that line's tag. The connection is closed after the
+    last step.
+    """
+
+    def __init__(self, sock, steps):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.steps = steps
+
+    def run(self):
+        lines = self.sock.makefile('rb')
+        self.sock.sendall(b'* OK [CAPABILITY IMAP4rev1 IDLE] ready\r\n')
+        tag = b''
+        for command, reply in [(b'CAPABILITY', b'* CAPABILITY IMAP4rev1 IDLE\r\n{tag} OK done\r\n')] + self.steps:
+            line = lines.readline().rstrip(b'\r\n')
+            if not line.endswith(command):
+                break
+            if line != b'DONE':
+                tag = line.split()[0]
+            self.sock.sendall(reply.replace(b'{tag}', tag))
+        lines.close()
+        self.sock.close()
+
+
+def _session(steps):
+    client, server = socket.socketpair()
+    _ScriptedServer(server, steps).start()
+    return _PairedIMAP4(client)
+
+
+class WaitForNewEmailsTest(unittest.TestCase):
+
+    def test_replies(self):
+        cases = [
+            ("new email", [(b'IDLE', b'+ idling\r\n* 4 EXISTS\r\n'), (b'DONE', b'{tag} OK done\r\n')], True),
+            ("timeout", [(b'IDLE', b'+ idling\r\n'), (b'DONE', b'{tag} OK done\r\n')], False),
+            ("other untagged responses", [
+                (b'IDLE', b'+ idling\r\n* 3 EXPUNGE\r\n* 2 FETCH (FLAGS (\\Seen))\r\n'),
+                (b'DONE', b'{tag} OK done\r\n')], False),
+            ("untagged before the continuation", [
+                (b'IDLE', b'* 3 EXPUNGE\r\n+ idling\r\n'), (b'DONE', b'{tag} OK done\r\n')], False),
+            ("new email before the continuation", [
+                (b'IDLE', b'* 4 EXISTS\r\n+ idling\r\n'), (b'DONE', b'{tag} OK done\r\n')], True),
+            ("new email after DONE", [
+                (b'IDLE', b'+ idling\r\n'), (b'DONE', b'* 4 EXISTS\r\n{tag} OK done\r\n')], True),
+            ("new email buffered before IDLE", [
+                (b'NOOP', b'{tag} OK done\r\n* 4 EXISTS\r\n'),
+                (b'IDLE', b'+ idling\r\n'), (b'DONE', b'{tag} OK done\r\n')], True),
+        ]
+        for description, steps, expected in cases:
+            with self.subTest(description):
+                imap_session = _session(steps + [(b'NOOP', b'* 5 RECENT\r\n{tag} OK done\r\n')])
+                if steps[0][0] == b'NOOP':
+                    imap_session.noop()
+                self.assertEqual(wait_for_new_emails(imap_session, timeout=0.1), expected)
+                # The session stays in step with the server for later commands
+                self.assertEqual(imap_session.noop()[0], 'OK')
+                imap_session.shutdown()
+
+    def test_data_after_idle_is_left_for_imaplib(self):
+        imap_session = _session([
+            (b'IDLE', b'+ idling\r\n'),
+            (b'DONE', b'{tag} OK done\r\n* 7 EXISTS\r\n'),
+            (b'NOOP', b'{tag} OK done\r\n'),
+        ])
+        self.assertFalse(wait_for_new_emails(imap_session, timeout=0.1))
+        self.assertEqual(imap_session.noop()[0], 'OK')
+        self.assertEqual(imap_session.response('EXISTS'), ('EXISTS', [b'7']))
+        imap_session.shutdown()
+
+    def test_failures(self):
+        cases = [
+            ("rejected", [(b'IDLE', b'{tag} BAD unknown command\r\n')], imaplib.IMAP4.error, 'SELECTED'),
+            ("closed during IDLE", [(b'IDLE', b'+ idling\r\n* BYE shutting down\r\n')],
+             imaplib.IMAP4.abort, 'LOGOUT'),
+            ("dropped during IDLE", [(b'IDLE', b'+ idling\r\n'), (b'DONE', b'')], imaplib.IMAP4.abort, 'LOGOUT'),
+        ]
+        for description, steps, error, state in cases:
+            with self.subTest(description):
+                imap_session = _session(steps)
+                imap_session.state = 'SELECTED'
+                with self.assertRaises(error):
+                    wait_for_new_emails(imap_session, timeout=0.1)
+                # Sessions left in IDLE are never reused
+                self.assertEqual(imap_session.state, state)
+                if state != 'LOGOUT':
+                    imap_session.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
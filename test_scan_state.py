@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+import unittest
+
+from scan_state import SEARCH_STATE, WATCH_STATE, load_scan_state, save_scan_state
+
+
+class ScanStateTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'scan_state.json')
+
+    def test_unusable_files(self):
+        cases = [
+            ("missing", None, False),
+            ("not JSON", '{"watch": ', True),
+            ("not an object", '[1, 2]', True),
+            ("old flat format", '{"INBOX": {"uidvalidity": 1, "uidnext": 5}}', False),
+            ("section not an object", '{"watch": []}', False),
+        ]
+        for description, content, warns in cases:
+            with self.subTest(description):
+                if content is not None:
+                    with open(self.path, 'w', encoding='utf-8') as state_file:
+                        state_file.write(content)
+                logs = self.assertLogs('scan_state', 'WARNING') if warns else self.assertNoLogs('scan_state')
+                with logs:
+                    self.assertEqual(load_scan_state(self.path, WATCH_STATE), {})
+
+    def test_round_trip(self):
+        watch_state = {'INBOX': {'uidvalidity': 1, 'uidnext': 5}}
+        search_state = {'INBOX': {'uidvalidity': 1, 'uidnext': 9}, 'Work': {'uidvalidity': 3, 'uidnext': 2}}
+        save_scan_state(self.path, WATCH_STATE, watch_state)
+        save_scan_state(self.path, SEARCH_STATE, search_state)
+        self.assertEqual(load_scan_state(self.path, WATCH_STATE), watch_state)
+        self.assertEqual(load_scan_state(self.path, SEARCH_STATE), search_state)
+
+        watch_state['INBOX']['uidnext'] = 6
+        save_scan_state(self.path, WATCH_STATE, watch_state)
+        with open(self.path, encoding='utf-8') as state_file:
+            self.assertEqual(json.load(state_file), {WATCH_STATE: watch_state, SEARCH_STATE: search_state})
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['scan_state.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
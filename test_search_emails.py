@@ -0,0 +1,395 @@
+import base64
+import io
+import os
+import quopri
+import re
+import tempfile
+import unittest
+
+from scan_state import SEARCH_STATE, WATCH_STATE, load_scan_state, save_scan_state
+from search_emails import (
+    _TransferDecoder, _parse_fetch_response, _part_file_name, download_attachment,
+    get_attachment_parts, list_mailboxes, search_emails_since, search_new_emails)
+
+
+def _part(media_type, subtype, disposition=b'NIL', params=b'NIL', encoding=b'"BASE64"'):
+    """
+    Builds a non-multipart BODYSTRUCTURE as a server sends it.
+    """
+    extra = b' 2' if media_type == b'TEXT' else b''
+    return (b'("%s" "%s" %s NIL NIL %s 100%s NIL %s NIL NIL)'
+            % (media_type, subtype, params, encoding, extra, disposition))
+
+
+def _attachment(file_name_params):
+    return b'("ATTACHMENT" (%s))' % file_name_params
+
+
+_TEXT_BODY = _part(b'TEXT', b'PLAIN', encoding=b'"7BIT"')
+_PDF = _part(b'APPLICATION', b'PDF', _attachment(b'"FILENAME" "report.pdf"'))
+_ENVELOPE = b'("Mon, 4 Mar 2024 10:00:00 +0000" "Invoice" (("Ann" NIL "ann" "example.org")) NIL NIL NIL NIL NIL NIL NIL)'
+_NESTED_MESSAGE = (
+    b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 500 %s (%s %s "MIXED" NIL NIL NIL NIL) 20 NIL %s NIL NIL)'
+    % (_ENVELOPE, _TEXT_BODY, _PDF, _attachment(b'"FILENAME" "forwarded.eml"')))
+_SINGLE_PART_MESSAGE = (
+    b'("MESSAGE" "RFC822" NIL NIL NIL "7BIT" 500 %s %s 20 NIL %s NIL NIL)'
+    % (_ENVELOPE, _PDF, _attachment(b'"FILENAME" "forwarded.eml"')))
+
+
+class _FakeSession:
+    """
+    Answers UID FETCH with canned imaplib-shaped response data.
+    """
+    capabilities = ('IMAP4REV1',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def uid(self, command, message_set, message_parts):
+        return 'OK', self.data
+
+
+def _fetch_data(uid, body_structure):
+    return [b'1 (UID %s ENVELOPE %s BODYSTRUCTURE %s)' % (uid, _ENVELOPE, body_structure)]
+
+
+class ParseFetchResponseTest(unittest.TestCase):
+
+    def test_literals_in_envelope(self):
+        # imaplib keeps each literal in a (prefix, literal) tuple; the text
+        # between literals and the closing parentheses follow as plain bytes
+        data = [
+            (b'1 (UID 7 ENVELOPE ("Mon, 4 Mar 2024 10:00:00 +0000" {18}', b'Quarterly "report"'),
+            (b' (({9}', b'Ann (HQ)\\'),
+            b' NIL "ann" "example.org")) NIL NIL NIL NIL NIL NIL NIL) BODYSTRUCTURE ' + _PDF + b')',
+            (b'2 (UID 9 ENVELOPE (NIL {3}', b'a)b'),
+            b' NIL NIL NIL NIL NIL NIL NIL NIL) BODYSTRUCTURE ' + _PDF,
+            b')',
+        ]
+        responses = _parse_fetch_response(data)
+        self.assertEqual(list(responses), ['7', '9'])
+        envelope = responses['7'][b'ENVELOPE']
+        self.assertEqual(envelope[1], b'Quarterly "report"')
+        self.assertEqual(envelope[2], [[b'Ann (HQ)\\', None, b'ann', b'example.org']])
+        self.assertEqual(responses['9'][b'ENVELOPE'][1], b'a)b')
+        self.assertEqual(responses['9'][b'BODYSTRUCTURE'][0], b'APPLICATION')
+
+    def test_quoted_strings_and_nil(self):
+        data = [b'3 (UID 12 ENVELOPE (NIL "say \\"hi\\" (now)" NIL NIL NIL NIL NIL NIL NIL NIL))']
+        envelope = _parse_fetch_response(data)['12'][b'ENVELOPE']
+        self.assertEqual(envelope[0], None)
+        self.assertEqual(envelope[1], b'say "hi" (now)')
+
+    def test_sequence_numbers(self):
+        data = [b'4 (BODYSTRUCTURE ' + _PDF + b')', b'5 (UID 9 FLAGS (\\Seen))']
+        self.assertEqual(list(_parse_fetch_response(data, by_uid=False)), ['4', '5'])
+
+    def test_unsolicited_responses(self):
+        # Flag updates without a UID may arrive during a UID FETCH
+        data = [b'9 (FLAGS (\\Seen))', b'4 (UID 9 BODYSTRUCTURE ' + _PDF + b')', b'2 (FLAGS ())']
+        responses = _parse_fetch_response(data)
+        self.assertEqual(list(responses), ['9'])
+        self.assertNotIn(b'FLAGS', responses['9'])
+
+
+class GetAttachmentPartsTest(unittest.TestCase):
+
+    def test_attachments(self):
+        cases = [
+            ("single part", _PDF, '.pdf', [('1', 'base64', 'report.pdf')]),
+            ("multipart/mixed", b'(%s %s "MIXED" ("BOUNDARY" "b") NIL NIL NIL)' % (_TEXT_BODY, _PDF),
+             '.pdf', [('2', 'base64', 'report.pdf')]),
+            ("multipart/signed", b'((%s %s "MIXED" NIL NIL NIL NIL) %s "SIGNED" NIL NIL NIL NIL)'
+             % (_TEXT_BODY, _PDF, _part(b'APPLICATION', b'PKCS7-SIGNATURE')),
+             '.pdf', [('1.2', 'base64', 'report.pdf')]),
+            ("text/plain attachment", b'(%s %s "MIXED" NIL NIL NIL NIL)' % (
+                _TEXT_BODY, _part(b'TEXT', b'PLAIN', _attachment(b'"FILENAME" "notes.txt"'),
+                                  encoding=b'"QUOTED-PRINTABLE"')),
+             '.txt', [('2', 'quoted-printable', 'notes.txt')]),
+            ("message/rfc822 attachment", b'(%s %s "MIXED" NIL NIL NIL NIL)' % (_TEXT_BODY, _NESTED_MESSAGE),
+             '.eml', [('2', '7bit', 'forwarded.eml')]),
+            ("inside message/rfc822", b'(%s %s "MIXED" NIL NIL NIL NIL)' % (_TEXT_BODY, _NESTED_MESSAGE),
+             '.pdf', [('2.2', 'base64', 'report.pdf')]),
+            ("inside single part message/rfc822", b'(%s %s "MIXED" NIL NIL NIL NIL)' % (
+                _TEXT_BODY, _SINGLE_PART_MESSAGE),
+             '.pdf', [('2.1', 'base64', 'report.pdf')]),
+            ("other extension", _PDF, '.docx', []),
+            ("no disposition", _part(b'APPLICATION', b'PDF', params=b'("NAME" "report.pdf")'), '.pdf', []),
+        ]
+        for description, body_structure, file_extension, expected in cases:
+            with self.subTest(description):
+                session = _FakeSession(_fetch_data(b'42', body_structure))
+                attachments = get_attachment_parts(session, ['42'], file_extension)
+                self.assertEqual(
+                    [(part, encoding, file_name) for _uid, part, encoding, _subject, _from, file_name
+                     in attachments],
+                    expected)
+                for uid, _part_number, _encoding, subject, from_, _file_name in attachments:
+                    self.assertEqual((uid, subject, from_), ('42', 'Invoice', 'Ann <ann@example.org>'))
+
+    def test_file_names(self):
+        cases = [
+            ("plain", _attachment(b'"FILENAME" "report.pdf"'), b'NIL', 'report.pdf'),
+            ("RFC 2047", _attachment(b'"FILENAME" "=?utf-8?B?w7xiZXIucGRm?="'), b'NIL', 'über.pdf'),
+            ("RFC 2231", _attachment(b'"FILENAME*" "utf-8\'\'r%C3%A9sum%C3%A9.pdf"'), b'NIL', 'résumé.pdf'),
+            ("RFC 2231 encoded extension", _attachment(b'"FILENAME*" "utf-8\'\'report%2Epdf"'), b'NIL',
+             'report.pdf'),
+            ("RFC 2231 encoded continuation", _attachment(b'"FILENAME*0" "report" "FILENAME*1*" "%2E%70df"'),
+             b'NIL', 'report.pdf'),
+            ("RFC 2231 continuations", _attachment(b'"FILENAME*0" "annual " "FILENAME*1" "report.pdf"'),
+             b'NIL', 'annual report.pdf'),
+            ("RFC 2231 extended continuations",
+             _attachment(b'"FILENAME*0*" "utf-8\'\'Gro%C3%9Fer%20" "FILENAME*1" "Bericht.pdf"'),
+             b'NIL', 'Großer Bericht.pdf'),
+            ("name fallback", b'("INLINE" NIL)', b'("NAME" "scan.pdf")', 'scan.pdf'),
+            ("name continuations fallback", b'("INLINE" NIL)', b'("NAME*0" "sc" "NAME*1" "an.pdf")', 'scan.pdf'),
+        ]
+        for description, disposition, params, expected in cases:
+            with self.subTest(description):
+                body_structure = _part(b'APPLICATION', b'PDF', disposition, params)
+                session = _FakeSession(_fetch_data(b'1', body_structure))
+                attachments = get_attachment_parts(session, ['1'], '.pdf')
+                self.assertEqual([file_name for *_rest, file_name in attachments], [expected])
+
+    def test_unsolicited_responses(self):
+        data = [b'3 (FLAGS (\\Seen))', b'8 (UID 77 FLAGS (\\Seen))'] + _fetch_data(b'42', _PDF)
+        with self.assertLogs('search_emails', 'INFO') as logs:
+            attachments = get_attachment_parts(_FakeSession(data), ['42'], '.pdf')
+        self.assertEqual([attachment[0] for attachment in attachments], ['42'])
+        self.assertIn("Completed processing 1 emails", logs.output[-1])
+
+    def test_continuation_gap(self):
+        body_structure = [b'APPLICATION', b'PDF', None, None, None, b'BASE64', b'100', None,
+                          [b'ATTACHMENT', [b'FILENAME*0', b'a', b'FILENAME*2', b'c.pdf']], None, None]
+        self.assertEqual(_part_file_name(body_structure), (b'a', False))
+
+
+class _ListSession:
+    """
+    Answers LIST with canned imaplib-shaped response data.
+    """
+
+    def __init__(self, typ, data):
+        self.typ = typ
+        self.data = data
+
+    def list(self):
+        return self.typ, self.data
+
+
+class ListMailboxesTest(unittest.TestCase):
+
+    def test_list_mailboxes(self):
+        cases = [
+            ("atoms", [b'(\\HasNoChildren) "/" INBOX', b'(\\HasNoChildren) "/" Archive'],
+             ['INBOX', 'Archive']),
+            ("quoted names with spaces", [b'(\\HasNoChildren \\All) "/" "[Gmail]/All Mail"'],
+             ['[Gmail]/All Mail']),
+            ("quoted names with escapes", [b'() "/" "Say \\"hi\\""'], ['Say "hi"']),
+            ("dot delimiter", [b'(\\HasChildren) "." INBOX', b'(\\HasNoChildren) "." "INBOX.Sent Items"'],
+             ['INBOX', 'INBOX.Sent Items']),
+            ("NIL delimiter", [b'() NIL Notes'], ['Notes']),
+            ("Noselect", [b'(\\Noselect \\HasChildren) "/" "[Gmail]"', b'(\\NoSelect) "/" Old',
+                          b'(\\HasNoChildren) "/" "[Gmail]/Sent Mail"'],
+             ['[Gmail]/Sent Mail']),
+            ("literal names", [(b'(\\HasNoChildren) "/" {11}', 'Café "1"'.encode()), b'',
+                               (b'(\\Noselect) "/" {4}', b'Old)'), b'',
+                               b'(\\HasNoChildren) "/" INBOX'],
+             ['Café "1"', 'INBOX']),
+            ("empty", [None], []),
+        ]
+        for description, data, expected in cases:
+            with self.subTest(description):
+                self.assertEqual(list_mailboxes(_ListSession('OK', data)), expected)
+
+    def test_list_failed(self):
+        with self.assertLogs('search_emails', 'ERROR'):
+            self.assertIsNone(list_mailboxes(_ListSession('NO', [b'LIST failed'])))
+
+
+class _MailboxSession:
+    """
+    Serves EXAMINE and UID SEARCH for one mailbox of emails given as a
+    {UID: within the searched date range} dict.
+    """
+    capabilities = ('IMAP4REV1',)
+    state = 'AUTH'
+
+    def __init__(self, emails, uid_validity=1, uid_next=0):
+        self.emails = emails
+        self.uid_validity = uid_validity
+        # 0 stands for the next UID after the emails, None for no UIDNEXT at all
+        self.uid_next = uid_next if uid_next != 0 else max(emails, default=0) + 1
+        self.searches = []
+
+    def select(self, mailbox, readonly=False):
+        self.state = 'SELECTED'
+        return 'OK', [str(len(self.emails)).encode()]
+
+    def response(self, code):
+        value = {'UIDVALIDITY': self.uid_validity, 'UIDNEXT': self.uid_next}.get(code)
+        return code, [None if value is None else str(value).encode()]
+
+    def uid(self, command, charset, criteria):
+        criteria = criteria.decode() if isinstance(criteria, bytes) else criteria
+        self.searches.append(criteria)
+        uids = sorted(uid for uid, in_range in self.emails.items()
+                      if in_range or 'SINCE' not in criteria)
+        match = re.search(r'UID (\d+):\*|UID \*', criteria)
+        if match and self.emails:
+            # "n:*" is the range between n and the highest UID, in either order
+            highest = max(self.emails)
+            low = min(int(match.group(1) or highest), highest)
+            uids = [uid for uid in uids if low <= uid <= max(low, highest)]
+        elif match:
+            uids = []
+        return 'OK', [' '.join(map(str, uids)).encode()]
+
+
+class SearchStateTest(unittest.TestCase):
+
+    def test_search_emails_since(self):
+        emails = {3: True, 4: False, 7: True, 8: True}
+        cases = [
+            ("first run", {}, None, ['3', '7', '8'], {'uidvalidity': 1, 'uidnext': 9}, None),
+            ("matching state", {}, {'uidvalidity': 1, 'uidnext': 5}, ['7', '8'],
+             {'uidvalidity': 1, 'uidnext': 9}, 'UID 5:*'),
+            ("UIDVALIDITY changed", {'uid_validity': 2}, {'uidvalidity': 1, 'uidnext': 5},
+             ['3', '7', '8'], {'uidvalidity': 2, 'uidnext': 9}, None),
+            ("nothing new", {}, {'uidvalidity': 1, 'uidnext': 9}, [],
+             {'uidvalidity': 1, 'uidnext': 9}, 'UID 9:*'),
+            ("state past the highest UID", {}, {'uidvalidity': 1, 'uidnext': 12}, [],
+             {'uidvalidity': 1, 'uidnext': 12}, 'UID 12:*'),
+            ("UIDNEXT past the emails", {'uid_next': 20}, {'uidvalidity': 1, 'uidnext': 5},
+             ['7', '8'], {'uidvalidity': 1, 'uidnext': 20}, 'UID 5:*'),
+            ("no UIDNEXT", {'uid_next': None}, None, ['3', '7', '8'],
+             {'uidvalidity': 1, 'uidnext': 9}, None),
+        ]
+        for description, session_options, mailbox_state, expected_ids, expected_state, uid_range in cases:
+            with self.subTest(description):
+                session = _MailboxSession(emails, **session_options)
+                email_ids, state = search_emails_since(
+                    session, 'INBOX', "01-Mar-2024", "04-Mar-2024", mailbox_state=mailbox_state)
+                self.assertEqual((email_ids, state), (expected_ids, expected_state))
+                if uid_range:
+                    self.assertIn(uid_range, session.searches[-1])
+                else:
+                    self.assertNotIn('UID', session.searches[-1])
+
+    def test_search_new_emails(self):
+        emails = {3: True, 4: False, 7: True, 8: True}
+        cases = [
+            ("first run", emails, {}, None, [], {'uidvalidity': 1, 'uidnext': 9}),
+            ("first run without UIDNEXT", emails, {'uid_next': None}, None, [],
+             {'uidvalidity': 1, 'uidnext': 9}),
+            ("first run in an empty mailbox without UIDNEXT", {}, {'uid_next': None}, None, [],
+             {'uidvalidity': 1, 'uidnext': 1}),
+            ("UIDVALIDITY changed", emails, {'uid_validity': 2}, {'uidvalidity': 1, 'uidnext': 5}, [],
+             {'uidvalidity': 2, 'uidnext': 9}),
+            ("new emails", emails, {}, {'uidvalidity': 1, 'uidnext': 5}, ['7', '8'],
+             {'uidvalidity': 1, 'uidnext': 9}),
+            ("nothing new", emails, {}, {'uidvalidity': 1, 'uidnext': 9}, [],
+             {'uidvalidity': 1, 'uidnext': 9}),
+            ("state past the highest UID", emails, {}, {'uidvalidity': 1, 'uidnext': 12}, [],
+             {'uidvalidity': 1, 'uidnext': 12}),
+            ("UIDNEXT past the emails", emails, {'uid_next': 20}, {'uidvalidity': 1, 'uidnext': 5},
+             ['7', '8'], {'uidvalidity': 1, 'uidnext': 20}),
+        ]
+        for description, mailbox, session_options, mailbox_state, expected_ids, expected_state in cases:
+            with self.subTest(description):
+                session = _MailboxSession(mailbox, **session_options)
+                self.assertEqual(search_new_emails(session, 'INBOX', mailbox_state),
+                                 (expected_ids, expected_state))
+
+    def test_search_and_watch_keep_separate_state(self):
+        emails = {1: True, 2: False, 3: True}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'scan_state.json')
+            watch_state = load_scan_state(path, WATCH_STATE)
+            email_ids, watch_state['INBOX'] = search_new_emails(
+                _MailboxSession(emails), 'INBOX', watch_state.get('INBOX'))
+            self.assertEqual(email_ids, [])
+            save_scan_state(path, WATCH_STATE, watch_state)
+
+            # Emails arrive while the watch is stopped, then a search runs
+            emails.update({4: False, 5: True})
+            search_state = load_scan_state(path, SEARCH_STATE)
+            email_ids, search_state['INBOX'] = search_emails_since(
+                _MailboxSession(emails), 'INBOX', "01-Mar-2024", "04-Mar-2024",
+                mailbox_state=search_state.get('INBOX'))
+            self.assertEqual(email_ids, ['1', '3', '5'])
+            save_scan_state(path, SEARCH_STATE, search_state)
+
+            # The restarted watch still reports everything it has not seen
+            watch_state = load_scan_state(path, WATCH_STATE)
+            email_ids, _watch_state = search_new_emails(
+                _MailboxSession(emails), 'INBOX', watch_state.get('INBOX'))
+            self.assertEqual(email_ids, ['4', '5'])
+            self.assertEqual(load_scan_state(path, SEARCH_STATE)['INBOX']['uidnext'], 6)
+
+
+_BINARY = bytes(range(256)) * 3
+# Quoted-printable encoders normalise line breaks, so it only round-trips text
+_TEXT = ("Grüße = 100% " * 10 + "\n").encode() * 5
+
+
+class _PartSession:
+    """
+    Serves BODY.PEEK[part]<offset.size> FETCHes of an encoded part as imaplib does.
+    """
+
+    def __init__(self, encoded):
+        self.encoded = encoded
+
+    def uid(self, command, message_set, message_parts):
+        part, offset, size = re.match(
+            r'\(BODY\.PEEK\[([\d.]+)\]<(\d+)\.(\d+)>\)', message_parts).groups()
+        chunk = self.encoded[int(offset):int(offset) + int(size)]
+        prefix = b'1 (UID %s BODY[%s]<%s> {%d}' % (
+            message_set.encode(), part.encode(), offset.encode(), len(chunk))
+        return 'OK', [(prefix, chunk), b')']
+
+
+class TransferDecoderTest(unittest.TestCase):
+
+    cases = [
+        ('base64', base64.encodebytes(_BINARY), _BINARY),
+        ('base64', base64.b64encode(_BINARY), _BINARY),
+        ('quoted-printable', quopri.encodestring(_TEXT), _TEXT),
+        ('quoted-printable', quopri.encodestring(_TEXT).replace(b'\n', b'\r\n'),
+         _TEXT.replace(b'\n', b'\r\n')),
+        ('7bit', _TEXT, _TEXT),
+    ]
+
+    def test_chunk_boundaries(self):
+        for encoding, encoded, payload in self.cases:
+            for chunk_size in (1, 2, 3, 5, 76, 77, 1000, len(encoded)):
+                with self.subTest(encoding=encoding, chunk_size=chunk_size, length=len(encoded)):
+                    decoder = _TransferDecoder(encoding)
+                    decoded = b''.join(decoder.decode(encoded[start:start + chunk_size])
+                                       for start in range(0, len(encoded), chunk_size))
+                    self.assertEqual(decoded + decoder.flush(), payload)
+
+    def test_unterminated_input(self):
+        cases = [
+            ('base64', b'SGVsbG8', b'Hello'),
+            ('quoted-printable', b'Gr=C3=BC=C3=9Fe', 'Grüße'.encode()),
+        ]
+        for encoding, encoded, expected in cases:
+            with self.subTest(encoding):
+                decoder = _TransferDecoder(encoding)
+                self.assertEqual(decoder.decode(encoded) + decoder.flush(), expected)
+
+    def test_download_attachment(self):
+        for encoding, encoded, payload in self.cases:
+            for chunk_size in (7, 64, len(encoded), len(encoded) + 1):
+                with self.subTest(encoding=encoding, chunk_size=chunk_size):
+                    output = io.BytesIO()
+                    written = download_attachment(
+                        _PartSession(encoded), '5', '2', encoding, output, chunk_size)
+                    self.assertEqual(output.getvalue(), payload)
+                    self.assertEqual(written, len(payload))
+
+
+if __name__ == '__main__':
+    unittest.main()